@@ -1,30 +1,194 @@
 # connectors/ynab.py
 
 import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import inspect
+import functools
+import orjson
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
-def tool(name, description, parameters):
-    """Decorator to mark a function as a tool for the agent"""
+def tool(name, description, parameters, mutates=False):
+    """Decorator to mark a function as a tool for the agent; mutates=True for tools that write"""
     def decorator(fn):
         fn.__tool__ = {
             "name": name,
             "description": description,
-            "parameters": parameters
+            "parameters": parameters,
+            "mutates": mutates
         }
         return fn
     return decorator
 
+# (function name, *bound arguments) -> (expiry on the monotonic clock, value)
+_cache: Dict[tuple, tuple] = {}
+# tools run on several threads at once
+_cache_lock = threading.Lock()
+
+def ttl_cache(seconds=120):
+    """Decorator to cache a read-only tool's result for a number of seconds"""
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (fn.__name__, *bound.arguments.values())
+            
+            with _cache_lock:
+                cached = _cache.get(key)
+            now = time.monotonic()
+            if cached and cached[0] > now:
+                return cached[1]
+            
+            value = fn(*args, **kwargs)
+            with _cache_lock:
+                _cache[key] = (now + seconds, value)
+            return value
+        return wrapper
+    return decorator
+
+def _invalidate_cache(budget_id: str):
+    """Drop cached results that belong to a budget"""
+    with _cache_lock:
+        for key in [key for key in _cache if key[1:2] == (budget_id,)]:
+            del _cache[key]
+
 # Base URL for YNAB API
 BASE_URL = "https://api.youneedabudget.com/v1"
 
-def get_headers():
-    """Get the authorization headers for YNAB API"""
-    token = os.environ.get("YNAB_TOKEN")
-    if not token:
-        raise ValueError("YNAB_TOKEN not found in environment variables")
-    return {"Authorization": f"Bearer {token}"}
+# Endpoint templates, filled in with str.format
+_BUDGETS_URL = BASE_URL + "/budgets"
+_BUDGET_URL = BASE_URL + "/budgets/{budget_id}"
+_ACCOUNTS_URL = BASE_URL + "/budgets/{budget_id}/accounts"
+_TXN_URL = BASE_URL + "/budgets/{budget_id}/accounts/{account_id}/transactions"
+_CREATE_TXN_URL = BASE_URL + "/budgets/{budget_id}/transactions"
+
+# Delta-sync state, one JSON file per (budget, sync key) under a directory per budget
+KNOWLEDGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mem", "ynab_knowledge"
+)
+# path -> (mtime_ns, parsed state), so unchanged files aren't re-parsed
+_knowledge_cache: Dict[str, tuple] = {}
+_knowledge_cache_lock = threading.Lock()
+
+def _knowledge_dir(budget_id: str):
+    """Directory holding a budget's delta-sync state"""
+    # ids come from the model, so hash them rather than trust them as path parts
+    return os.path.join(KNOWLEDGE_DIR, hashlib.blake2b(budget_id.encode(), digest_size=16).hexdigest())
+
+def _knowledge_path(budget_id: str, sync_key: str):
+    """File holding one piece of a budget's delta-sync state"""
+    name = hashlib.blake2b(sync_key.encode(), digest_size=16).hexdigest()
+    return os.path.join(_knowledge_dir(budget_id), f"{name}.json")
+
+def _load_knowledge(budget_id: str, sync_key: str):
+    """Load one piece of persisted delta-sync state, or None if there is none"""
+    path = _knowledge_path(budget_id, sync_key)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _knowledge_cache_lock:
+        cached = _knowledge_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    with _knowledge_cache_lock:
+        _knowledge_cache[path] = (mtime, state)
+    return state
+
+def _save_knowledge(budget_id: str, sync_key: str, state):
+    """Persist one piece of delta-sync state, leaving the rest untouched"""
+    path = _knowledge_path(budget_id, sync_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+    mtime = os.stat(path).st_mtime_ns
+    with _knowledge_cache_lock:
+        _knowledge_cache[path] = (mtime, state)
+
+def _merge_delta(cached: List[Dict[str, Any]], changed: List[Dict[str, Any]]):
+    """Apply changed records to a cached list, keyed by id, dropping deleted ones"""
+    merged = {record["id"]: record for record in cached}
+    for record in changed:
+        if record.get("deleted"):
+            merged.pop(record["id"], None)
+        else:
+            merged[record["id"]] = record
+    return list(merged.values())
+
+def invalidate_knowledge(budget_id: str):
+    """Forget the delta-sync state of a budget so the next read is a full fetch"""
+    budget_dir = _knowledge_dir(budget_id)
+    shutil.rmtree(budget_dir, ignore_errors=True)
+    with _knowledge_cache_lock:
+        for path in [path for path in _knowledge_cache if os.path.dirname(path) == budget_dir]:
+            del _knowledge_cache[path]
+
+# Retry budget shared by the session's GET policy and create_transaction's 429 handling
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.5
+# longest Retry-After create_transaction will wait out; past it the 429 is raised
+RETRY_AFTER_MAX = 30
+
+# Most connections kept alive to the API; more concurrent requests than this get
+# fresh connections that urllib3 throws away afterwards
+POOL_MAXSIZE = 16
+
+# Shared session so every call reuses pooled keep-alive connections to the API
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=POOL_MAXSIZE,
+        # Back off and retry reads on rate limiting and transient server errors.
+        # POST is left out: a 5xx can arrive after the write was committed.
+        max_retries=Retry(
+            total=RETRY_TOTAL,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True
+        )
+    )
+)
+
+def _session():
+    """Get the shared session, attaching the YNAB authorization header on first use"""
+    if "Authorization" not in SESSION.headers:
+        token = os.environ.get("YNAB_TOKEN")
+        if not token:
+            raise ValueError("YNAB_TOKEN not found in environment variables")
+        SESSION.headers.update({"Authorization": f"Bearer {token}"})
+    return SESSION
+
+# Shared by every get_transactions_bulk call. The agent runs up to 8 tools at once
+# alongside it, so half the connection pool is left for them.
+_FETCH_POOL = ThreadPoolExecutor(max_workers=POOL_MAXSIZE // 2)
+
+def _get_data(url: str, params: Optional[Dict[str, Any]] = None):
+    """GET a YNAB endpoint and decode the "data" object of its response"""
+    response = _session().get(url, params=params)
+    response.raise_for_status()
+    return orjson.loads(response.content)["data"]
 
 @tool(
     name="get_budgets",
@@ -35,11 +199,10 @@ def get_headers():
         "required": []
     }
 )
+@ttl_cache(seconds=300)
 def get_budgets():
     """Get a list of budgets from YNAB"""
-    response = requests.get(f"{BASE_URL}/budgets", headers=get_headers())
-    response.raise_for_status()
-    return response.json()["data"]["budgets"]
+    return _get_data(_BUDGETS_URL)["budgets"]
 
 @tool(
     name="get_accounts",
@@ -55,11 +218,10 @@ def get_budgets():
         "required": ["budget_id"]
     }
 )
+@ttl_cache(seconds=120)
 def get_accounts(budget_id: str):
     """Get a list of accounts for a specific budget"""
-    response = requests.get(f"{BASE_URL}/budgets/{budget_id}/accounts", headers=get_headers())
-    response.raise_for_status()
-    return response.json()["data"]["accounts"]
+    return _get_data(_ACCOUNTS_URL.format(budget_id=budget_id))["accounts"]
 
 @tool(
     name="get_transactions",
@@ -85,14 +247,27 @@ def get_accounts(budget_id: str):
 )
 def get_transactions(budget_id: str, account_id: str, since_date: Optional[str] = None):
     """Get transactions for a specific account"""
-    url = f"{BASE_URL}/budgets/{budget_id}/accounts/{account_id}/transactions"
+    sync_key = f"transactions|{account_id}|{since_date or ''}"
+    synced = _load_knowledge(budget_id, sync_key)
+    
+    params = {}
     if since_date:
-        url += f"?since_date={since_date}"
+        params["since_date"] = since_date
+    if synced:
+        # Only ask for what changed since the last sync
+        params["last_knowledge_of_server"] = synced["server_knowledge"]
     
-    response = requests.get(url, headers=get_headers())
-    response.raise_for_status()
+    data = _get_data(_TXN_URL.format(budget_id=budget_id, account_id=account_id), params or None)
+    raw_transactions = _merge_delta(synced["transactions"] if synced else [], data["transactions"])
+    raw_transactions.sort(key=lambda t: t.get("date", ""))
+    
+    _save_knowledge(budget_id, sync_key, {
+        "server_knowledge": data["server_knowledge"],
+        "transactions": raw_transactions
+    })
     
-    transactions = response.json()["data"]["transactions"]
+    # The synced copy stays in milliunits; hand out converted copies
+    transactions = [dict(transaction) for transaction in raw_transactions]
     
     # Convert milliunits to actual currency values
     for transaction in transactions:
@@ -101,6 +276,41 @@ def get_transactions(budget_id: str, account_id: str, since_date: Optional[str]
     
     return transactions
 
+@tool(
+    name="get_transactions_bulk",
+    description="Get transactions for several accounts of a budget at once",
+    parameters={
+        "type": "object",
+        "properties": {
+            "budget_id": {
+                "type": "string",
+                "description": "The ID of the budget"
+            },
+            "account_ids": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "The IDs of the accounts"
+            },
+            "since_date": {
+                "type": "string",
+                "description": "The earliest date for transactions (YYYY-MM-DD)"
+            }
+        },
+        "required": ["budget_id", "account_ids"]
+    }
+)
+def get_transactions_bulk(budget_id: str, account_ids: List[str], since_date: Optional[str] = None):
+    """Get transactions for several accounts, fetching them concurrently"""
+    if not account_ids:
+        return {}
+    
+    # Each fetch is blocking I/O, so threads sharing the pooled session overlap the round-trips
+    results = _FETCH_POOL.map(
+        lambda account_id: get_transactions(budget_id, account_id, since_date),
+        account_ids
+    )
+    return dict(zip(account_ids, results))
+
 @tool(
     name="get_budget_summary",
     description="Get a summary of budget categories and their balances",
@@ -115,13 +325,33 @@ def get_transactions(budget_id: str, account_id: str, since_date: Optional[str]
         "required": ["budget_id"]
     }
 )
+@ttl_cache(seconds=60)
 def get_budget_summary(budget_id: str):
     """Get a summary of budget categories and their balances"""
-    response = requests.get(f"{BASE_URL}/budgets/{budget_id}", headers=get_headers())
-    response.raise_for_status()
+    synced = _load_knowledge(budget_id, "budget")
+    
+    params = None
+    if synced:
+        # Only ask for what changed since the last sync
+        params = {"last_knowledge_of_server": synced["server_knowledge"]}
+    
+    data = _get_data(_BUDGET_URL.format(budget_id=budget_id), params)
+    budget_data = data["budget"]
+    raw_categories = _merge_delta(
+        synced["categories"] if synced else [],
+        budget_data.get("categories", [])
+    )
+    synced = {
+        "server_knowledge": data["server_knowledge"],
+        "name": budget_data.get("name", synced["name"] if synced else ""),
+        "currency_format": budget_data.get("currency_format") or (synced["currency_format"] if synced else {}),
+        "categories": raw_categories
+    }
     
-    budget_data = response.json()["data"]["budget"]
-    categories = budget_data.get("categories", [])
+    _save_knowledge(budget_id, "budget", synced)
+    
+    # The synced copy stays in milliunits; hand out converted copies
+    categories = [dict(category) for category in raw_categories]
     
     # Convert milliunits to actual currency values
     for category in categories:
@@ -133,8 +363,8 @@ def get_budget_summary(budget_id: str):
             category["activity"] = category["activity"] / 1000
     
     return {
-        "name": budget_data.get("name", ""),
-        "currency_format": budget_data.get("currency_format", {}),
+        "name": synced["name"],
+        "currency_format": synced["currency_format"],
         "categories": categories
     }
 
@@ -174,7 +404,8 @@ def get_budget_summary(budget_id: str):
             }
         },
         "required": ["budget_id", "account_id", "date", "amount", "payee_name"]
-    }
+    },
+    mutates=True
 )
 def create_transaction(
     budget_id: str, 
@@ -206,20 +437,26 @@ def create_transaction(
     if memo:
         transaction_data["transaction"]["memo"] = memo
     
-    response = requests.post(
-        f"{BASE_URL}/budgets/{budget_id}/transactions",
-        headers=get_headers(),
-        json=transaction_data
-    )
+    # Only a 429 is safe to replay: the request was rejected before anything was written
+    for attempt in range(RETRY_TOTAL + 1):
+        response = _session().post(
+            _CREATE_TXN_URL.format(budget_id=budget_id),
+            json=transaction_data
+        )
+        if response.status_code != 429 or attempt == RETRY_TOTAL:
+            break
+        try:
+            delay = max(float(response.headers["Retry-After"]), 0)
+        except (KeyError, ValueError):
+            delay = RETRY_BACKOFF * (2 ** attempt)
+        if delay > RETRY_AFTER_MAX:
+            # YNAB's limit is hourly; don't block the turn waiting it out
+            break
+        time.sleep(delay)
     response.raise_for_status()
     
-    return response.json()["data"]["transaction"]
-
-# Remove or comment out the example usage at the bottom
-# Example usage:
-budgets = get_budgets()
-print(budgets)
-transactions = get_transactions("8b6871aa-bd9f-465d-99ed-697872bd813f", "2025-05-02")
-print(transactions)
-summary = get_budget_summary("8b6871aa-bd9f-465d-99ed-697872bd813f")
-print(summary)
+    # Account balances and category activity just changed
+    _invalidate_cache(budget_id)
+    invalidate_knowledge(budget_id)
+    
+    return orjson.loads(response.content)["data"]["transaction"]
@@ -1,6 +1,10 @@
 # tinyagent.py
 
-import os, json, pkgutil, importlib, inspect
+import os, json, pkgutil, importlib, hashlib, shelve, time, pickle, ast, threading
+from glob import glob
+import concurrent.futures
+from types import MappingProxyType
+import orjson
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -9,37 +13,195 @@ client = OpenAI()
 
 CONNECTOR_PACKAGE = "connectors"
 connectors_path = os.path.join(os.path.dirname(__file__), CONNECTOR_PACKAGE)
+# local state (caches, sync data) lives next to the agent, not in the CWD
+MEM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mem")
 
-# tool_name -> (fn, spec_dict)
+# tool_name -> (fn, spec_dict); fn stays None until the connector is imported
 TOOLS: dict[str, tuple[callable, dict]] = {}
+# tool_name -> (module_name, fn_name)
+TOOL_SOURCES: dict[str, tuple[str, str]] = {}
+
+# discovered tools are cached here, keyed by the connector files' mtimes
+TOOLS_CACHE_DIR = os.path.join(MEM_DIR, ".tools_cache")
 
 # Ensure the connectors directory exists
 os.makedirs(connectors_path, exist_ok=True)
 
-for _, module_name, _ in pkgutil.iter_modules([connectors_path]):
+# parameters of the connectors' tool(name, description, parameters) decorator
+TOOL_ARGS = ("name", "description", "parameters", "mutates")
+TOOL_REQUIRED_ARGS = {"name", "description", "parameters"}
+
+def read_tool_specs(path):
+    """Read the literal @tool(...) specs from a connector's source without running it.
+    Raises ValueError when they can't be read statically."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    found = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for dec in node.decorator_list:
+            if not isinstance(dec, ast.Call):
+                continue
+            if isinstance(dec.func, ast.Attribute) and dec.func.attr == "tool":
+                raise ValueError(f"unrecognised @tool decorator on {node.name}")
+            if not (isinstance(dec.func, ast.Name) and dec.func.id == "tool"):
+                continue
+            # raises ValueError if the spec isn't a plain literal
+            meta = dict(zip(TOOL_ARGS, map(ast.literal_eval, dec.args)))
+            meta.update({kw.arg: ast.literal_eval(kw.value) for kw in dec.keywords})
+            if not TOOL_REQUIRED_ARGS <= set(meta) <= set(TOOL_ARGS):
+                raise ValueError(f"incomplete @tool spec on {node.name}")
+            meta.setdefault("mutates", False)
+            found.append((node.name, meta))
+
+    # aliased or otherwise unrecognised decorators would be missed silently
+    if not found:
+        raise ValueError(f"no @tool decorators found in {path}")
+    return found
+
+def discover_tools():
+    """Find every @tool function in the connectors -> [(module_name, fn_name, meta)]"""
+    found, complete = [], True
+    for _, module_name, _ in pkgutil.iter_modules([connectors_path]):
+        path = os.path.join(connectors_path, f"{module_name}.py")
+        try:
+            for fn_name, meta in read_tool_specs(path):
+                found.append((module_name, fn_name, meta))
+            continue
+        except (OSError, SyntaxError, ValueError):
+            pass
+
+        # not statically readable, fall back to importing it
+        try:
+            module = importlib.import_module(f"{CONNECTOR_PACKAGE}.{module_name}")
+            for fn_name, fn in vars(module).items():
+                meta = getattr(fn, "__tool__", None) if callable(fn) else None
+                if meta:
+                    found.append((module_name, fn_name, meta))
+        except ImportError as e:
+            complete = False
+            print(f"Error importing {module_name}: {e}")
+    return found, complete
+
+def load_tools():
+    """Fill TOOLS, reusing the cached discovery when no connector has changed"""
+    sources = sorted(glob(os.path.join(connectors_path, "*.py")))
+    sig = hashlib.blake2b(
+        b"".join(f"{p}:{os.path.getmtime(p)}".encode() for p in sources)
+    ).hexdigest()
+    cache_path = os.path.join(TOOLS_CACHE_DIR, f"{sig}.pkl")
+
     try:
+        with open(cache_path, "rb") as f:
+            found = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        found, complete = discover_tools()
+        # don't remember a scan that missed connectors because of import errors
+        if complete:
+            os.makedirs(TOOLS_CACHE_DIR, exist_ok=True)
+            with open(cache_path, "wb") as f:
+                pickle.dump(found, f)
+            # only the current signature can ever hit again
+            for stale in glob(os.path.join(TOOLS_CACHE_DIR, "*.pkl")):
+                if stale != cache_path:
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+
+    for module_name, fn_name, meta in found:
+        # store it in the map; the function itself is imported on first use
+        TOOLS[meta["name"]] = (None, meta)
+        TOOL_SOURCES[meta["name"]] = (module_name, fn_name)
+
+def resolve_tool(name):
+    """Get a tool's function, importing its connector if that hasn't happened yet"""
+    fn, meta = TOOLS[name]
+    if fn is None:
+        module_name, fn_name = TOOL_SOURCES[name]
         module = importlib.import_module(f"{CONNECTOR_PACKAGE}.{module_name}")
-        for _, fn in inspect.getmembers(module, inspect.isfunction):
-            meta = getattr(fn, "__tool__", None)
-            if not meta:
-                continue
-            # store it in the map
-            TOOLS[meta["name"]] = (fn, meta)
-    except ImportError as e:
-        print(f"Error importing {module_name}: {e}")
-
-# build the OpenAI tools spec
-TOOLS_SPEC = [
-    {
+        fn = getattr(module, fn_name)
+        TOOLS[name] = (fn, meta)
+    return fn
+
+def warm_connectors():
+    """Import every connector so the first tool call doesn't pay for it"""
+    for module_name in set(m for m, _ in TOOL_SOURCES.values()):
+        try:
+            importlib.import_module(f"{CONNECTOR_PACKAGE}.{module_name}")
+        except Exception as e:
+            print(f"Error importing {module_name}: {e}")
+
+load_tools()
+# overlap connector imports with the user typing their question
+threading.Thread(target=warm_connectors, daemon=True).start()
+
+# build the OpenAI tools spec once; it's read-only and shared by every agent() call
+TOOLS_SPEC = tuple(
+    MappingProxyType({
         "type": "function",
-        "function": {
+        "function": MappingProxyType({
             "name": name,
             "description": spec["description"],
             "parameters": spec["parameters"],
-        }
-    }
+        })
+    })
     for name, (_, spec) in TOOLS.items()
-]
+)
+
+# summaries are cached on disk, keyed by query + tool + raw result
+SUMMARY_CACHE_PATH = os.path.join(MEM_DIR, "summaries")
+SUMMARY_CACHE_TTL = 3600
+# output token budget for each summary in a batch
+SUMMARY_MAX_TOKENS = 120
+# most recent transactions kept per account when compacting results
+SUMMARY_MAX_TRANSACTIONS = 50
+
+def _compact_transactions(transactions):
+    shown = transactions[-SUMMARY_MAX_TRANSACTIONS:]
+    return {
+        # lets the summary say when it's only looking at part of the data
+        "note": f"showing the last {len(shown)} of {len(transactions)} transactions",
+        "total": len(transactions),
+        "shown": [
+            {
+                "date": t.get("date"),
+                "amount": t.get("amount"),
+                "payee_name": t.get("payee_name"),
+                "category_name": t.get("category_name"),
+            }
+            for t in shown
+        ],
+    }
+
+# tool_name -> fn that drops fields the summarizer doesn't need
+_COMPACT = {
+    "get_transactions": _compact_transactions,
+    "get_transactions_bulk": lambda by_account: {
+        account_id: _compact_transactions(transactions)
+        for account_id, transactions in by_account.items()
+    },
+    "get_budget_summary": lambda s: {
+        "name": s.get("name"),
+        "categories": [
+            {"name": c.get("name"), "balance": c.get("balance")}
+            for c in s.get("categories", []) if c.get("balance")
+        ],
+    },
+}
+
+def compact_result(tool_name, raw_result):
+    """Trim a tool result down to what the summarizer needs"""
+    compact = _COMPACT.get(tool_name)
+    if compact is None:
+        return raw_result
+    try:
+        return compact(raw_result)
+    except (AttributeError, TypeError):
+        # unexpected shape, send it as-is
+        return raw_result
 
 # ─── Agent & tool dispatch ────────────────────────────────────────────────
 def agent(msg: str):
@@ -50,59 +212,145 @@ def agent(msg: str):
         tool_choice="auto"
     )
 
-def summarize_response(original_query, tool_name, raw_result):
-    """Summarize the raw result in human-friendly language"""
+def _summary_key(original_query, tool_name, raw_result):
+    return hashlib.blake2b(
+        f"{original_query}|{tool_name}|{raw_result}".encode(), digest_size=16
+    ).hexdigest()
+
+def _serialize(raw_result):
+    """Convert a result to a string if it's not already"""
+    if isinstance(raw_result, str):
+        return raw_result
     try:
-        # Convert the result to a string if it's not already
-        if not isinstance(raw_result, str):
-            raw_result = json.dumps(raw_result, indent=2)
-        
-        # Create a prompt for the LLM to summarize the result
+        return orjson.dumps(raw_result, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        # not JSON serializable, fall back to its repr
+        return str(raw_result)
+
+def summarize_batch(original_query, items):
+    """Summarize several (tool_name, raw_result) pairs in human-friendly language with one LLM call"""
+    # The full results are what the user gets if summarization fails
+    summaries = [_serialize(raw_result) for _, raw_result in items]
+    # The model only sees the trimmed results
+    items = [(tool_name, _serialize(compact_result(tool_name, raw_result))) for tool_name, raw_result in items]
+    keys = [_summary_key(original_query, tool_name, raw_result) for tool_name, raw_result in items]
+    cached = [None] * len(keys)
+    try:
+        os.makedirs(os.path.dirname(SUMMARY_CACHE_PATH), exist_ok=True)
+        with shelve.open(SUMMARY_CACHE_PATH) as cache:
+            cached = [cache.get(key) for key in keys]
+    except Exception as e:
+        # a cache we can't read just means every item is a miss
+        print(f"Summary cache error: {e}")
+    
+    pending = []
+    for i, entry in enumerate(cached):
+        if entry and entry[0] > time.time():
+            summaries[i] = entry[1]
+        else:
+            pending.append(i)
+    if not pending:
+        return summaries
+    
+    done = []
+    try:
+        # Create one prompt covering every result that still needs a summary
+        blocks = "\n".join(
+            f"""
+        [{n}] The tool "{items[i][0]}" returned this result:
+        {items[i][1]}
+        """
+            for n, i in enumerate(pending, 1)
+        )
         prompt = f"""
         The user asked: "{original_query}"
-        
-        The tool "{tool_name}" returned this result:
-        {raw_result}
-        
-        Please provide a concise, human-friendly summary of this information. 
+        {blocks}
+        For each numbered result, provide a concise, human-friendly summary of this information. 
         Focus on the most important details that answer the user's question.
-        Use natural language and avoid technical jargon.
+        If a result notes that it only shows part of the data, say so rather than treating it as complete.
+        Use natural language and avoid technical jargon. Keep each summary to two or three sentences.
+        Reply with a JSON object of the form {{"summaries": ["summary of [1]", "summary of [2]", ...]}}.
         """
         
-        # Get a summary from the LLM
+        # Get all the summaries from the LLM at once
         response = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=300
+            max_tokens=SUMMARY_MAX_TOKENS * len(pending),
+            temperature=0.2,
+            response_format={"type": "json_object"}
         )
         
-        return response.choices[0].message.content.strip()
+        batch = json.loads(response.choices[0].message.content)["summaries"]
+        for i, summary in zip(pending, batch):
+            summaries[i] = summary.strip()
+            done.append(i)
     except Exception as e:
-        # If summarization fails, return the original result
+        # If summarization fails, fall back to the original results
         print(f"Summarization error: {e}")
-        return raw_result
+    
+    if done:
+        try:
+            with shelve.open(SUMMARY_CACHE_PATH) as cache:
+                for i in done:
+                    cache[keys[i]] = (time.time() + SUMMARY_CACHE_TTL, summaries[i])
+        except Exception as e:
+            print(f"Summary cache error: {e}")
+    return summaries
+
+def run_tool(call):
+    args = json.loads(call.function.arguments)
+
+    # look up the real function directly
+    fn = resolve_tool(call.function.name)
+    return fn(**args)
+
+def is_mutating(name):
+    """Whether a tool writes, per its @tool(..., mutates=True) spec"""
+    _, meta = TOOLS.get(name, (None, {}))
+    return meta.get("mutates", False)
 
 def process_tool_calls(response, original_query):
     choice = response.choices[0].message
     if not getattr(choice, "tool_calls", None):
         return choice.content
 
+    def capture(call):
+        try:
+            return run_tool(call), None
+        except Exception as e:
+            return None, e
+
+    calls = choice.tool_calls
+    outcomes = [None] * len(calls)
+
+    # reads are blocking HTTP calls, so run them side by side
+    reads = [i for i, call in enumerate(calls) if not is_mutating(call.function.name)]
+    if reads:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(reads))) as ex:
+            for i, outcome in zip(reads, ex.map(capture, [calls[i] for i in reads])):
+                outcomes[i] = outcome
+
+    # writes run one at a time once the reads are done, so no read in this
+    # turn races a write or re-caches what the write just invalidated
+    for i, call in enumerate(calls):
+        if outcomes[i] is None:
+            outcomes[i] = capture(call)
+
     results = []
-    for call in choice.tool_calls:
+    completed = []
+    for call, (raw_result, error) in zip(calls, outcomes):
         name = call.function.name
-        args = json.loads(call.function.arguments)
+        if error is None:
+            completed.append((len(results), name, raw_result))
+            results.append(None)
+        else:
+            results.append(f"{name} → Error: {str(error)}")
 
-        # look up the real function directly
-        fn, _ = TOOLS[name]
-        try:
-            raw_result = fn(**args)
-            
-            # Summarize the result
-            summarized_result = summarize_response(original_query, name, raw_result)
-            
-            results.append(f"{name} → {summarized_result}")
-        except Exception as e:
-            results.append(f"{name} → Error: {str(e)}")
+    # Summarize all the results in a single request
+    summaries = summarize_batch(original_query, [(name, raw_result) for _, name, raw_result in completed])
+    for (index, name, _), summarized_result in zip(completed, summaries):
+        results[index] = f"{name} → {summarized_result}"
 
     return "\n".join(results)
 
@@ -118,7 +366,7 @@ if __name__ == "__main__":
         exit(1)
 
     # ensure mem folder is in place
-    os.makedirs("mem", exist_ok=True)
+    os.makedirs(MEM_DIR, exist_ok=True)
 
     print("Available tools:")
     for name in TOOLS: